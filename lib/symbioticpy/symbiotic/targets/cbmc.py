@@ -19,7 +19,6 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import logging
-import xml.etree.ElementTree as ET
 
 try:
     import benchexec.util as util
@@ -41,12 +40,23 @@ except ImportError:
     # the default version
     llvm_version='10.0.1'
 
+# bounds for incremental BMC
+_UNWIND_BOUNDS = (2, 6, 12, 17, 21, 40, 200, 400, 1025, 2049, 268435456)
+
+# the results that determine_result can report for a found bug
+_FALSE_RESULTS = frozenset((result.RESULT_FALSE_REACH,
+                            result.RESULT_FALSE_TERMINATION,
+                            result.RESULT_FALSE_OVERFLOW,
+                            result.RESULT_FALSE_DEREF,
+                            result.RESULT_FALSE_FREE,
+                            result.RESULT_FALSE_MEMTRACK,
+                            result.RESULT_FALSE_MEMCLEANUP))
+
 class SymbioticTool(BaseTool, SymbioticBaseTool):
     """
     Tool info for CBMC (http://www.cprover.org/cbmc/).
-    It always adds --xml-ui to the command-line arguments for easier parsing of
-    the output, unless a propertyfile is passed -- in which case running under
-    SV-COMP conditions is assumed.
+    CBMC is run with the plain-text (--compact-trace) output and the result
+    is determined by scanning the output line by line.
     """
 
     def __init__(self, opts, only_results=None):
@@ -56,6 +66,7 @@ class SymbioticTool(BaseTool, SymbioticBaseTool):
         SymbioticBaseTool.__init__(self, opts)
         opts.explicit_symbolic = True
         self._only_results = only_results
+        self._verifiers = None
 
     def executable(self):
         return util.find_executable('cbmc')
@@ -97,16 +108,18 @@ class SymbioticTool(BaseTool, SymbioticBaseTool):
         return super().instrumentation_options()
 
     def verifiers(self):
-        bounds = (2, 6, 12, 17, 21, 40, 200, 400, 1025, 2049, 268435456)
-        setups = []
-        for b in bounds:
-            setups.append((SymbioticTool(self._options, only_results=['false']),
-                           ['--unwind', str(b)],
-                           None))
-            setups.append((SymbioticTool(self._options, only_results=['true']),
-                           ['--unwind', str(b), '--unwinding-assertions'],
-                           None))
-        return setups
+        # the setups do not change, so create them only once
+        if self._verifiers is None:
+            setups = []
+            for b in _UNWIND_BOUNDS:
+                setups.append((SymbioticTool(self._options, only_results=['false']),
+                               ['--unwind', str(b)],
+                               None))
+                setups.append((SymbioticTool(self._options, only_results=['true']),
+                               ['--unwind', str(b), '--unwinding-assertions'],
+                               None))
+            self._verifiers = setups
+        return self._verifiers
 
     def cmdline(self, executable, options, tasks, propertyfile, rlimits):
        #if propertyfile:
@@ -138,7 +151,12 @@ class SymbioticTool(BaseTool, SymbioticBaseTool):
 
     def determine_result(self, returncode, returnsignal, output, isTimeout):
         if returnsignal == 0 and ((returncode == 0) or (returncode == 10)):
+            # evaluate the property just once, not for every line
             prp = self._options.property
+            is_memsafety = prp.memsafety()
+            is_termination = prp.termination()
+            is_unreachcall = prp.unreachcall()
+            is_signedoverflow = prp.signedoverflow()
             status = result.RESULT_ERROR
             for line in output:
                 line = str(line.strip())
@@ -147,7 +165,7 @@ class SymbioticTool(BaseTool, SymbioticBaseTool):
                 elif "__CPROVER_memory_leak" in line or\
                      "allocated memory never freed" in line:
                     status = result.RESULT_FALSE_MEMTRACK\
-                            if prp.memsafety() else result.RESULT_FALSE_MEMCLEANUP
+                            if is_memsafety else result.RESULT_FALSE_MEMCLEANUP
                 elif "double free" in line or\
                      "free called for stack-allocated object" in line or\
                      "free argument" in line:
@@ -166,15 +184,15 @@ class SymbioticTool(BaseTool, SymbioticBaseTool):
                     else:
                         status = result.RESULT_TRUE_PROP
                 elif "VERIFICATION FAILED" in line:
-                    if prp.termination():
+                    if is_termination:
                         status = result.RESULT_FALSE_TERMINATION
-                    elif prp.unreachcall():
+                    elif is_unreachcall:
                         status = result.RESULT_FALSE_REACH
-                    elif prp.signedoverflow():
+                    elif is_signedoverflow:
                         status = result.RESULT_FALSE_OVERFLOW
                     # sanity check
-                    sw = status.lower().startswith
-                    if not (sw('false') or sw('unkown')):
+                    if status not in _FALSE_RESULTS and\
+                       status != result.RESULT_UNKNOWN:
                         status = 'PARSING FAILED'
 
         elif returncode == 64 and 'Usage error!\n' in output:
@@ -187,11 +205,12 @@ class SymbioticTool(BaseTool, SymbioticBaseTool):
             status = result.RESULT_ERROR
 
         if self._only_results:
-            res = status.lower()
-            if res.startswith('false'):
+            if status in _FALSE_RESULTS:
                 res = 'false'
-            elif res.startswith('true'):
+            elif status == result.RESULT_TRUE_PROP:
                 res = 'true'
+            else:
+                res = status
             if not res in self._only_results:
                 return result.RESULT_UNKNOWN
 
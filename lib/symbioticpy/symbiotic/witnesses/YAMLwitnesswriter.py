@@ -7,6 +7,26 @@ import datetime
 import re
 import yaml
 
+# use the libyaml bindings if they are available, they are much faster
+try:
+    from yaml import CSafeDumper as YAMLDumper
+except ImportError:
+    from yaml import SafeDumper as YAMLDumper
+
+# command that dumps the AST of the file appended to it
+_CLANG_AST_DUMP = ('clang', '-Xclang', '-ast-dump', '-fsyntax-only', '-fno-color-diagnostics')
+
+# patterns for scraping locations from the textual clang AST dump
+_LOC_BEGIN_END = re.compile(r"^[^-]*-([a-zA-Z]*) 0x[0-9A-Fa-f]* <([^>,]*), ([^,]*)>")
+_LOC_LINE = re.compile(r"^[^-]*-[a-zA-Z]* 0x[0-9A-Fa-f]* <([^:>]*):([0-9]*)")
+_FILE_LINE_COL = re.compile(r"([^:]*):([0-9]*):([0-9]*)")
+_LINE_LINE_COL = re.compile(r"line:([0-9]*):([0-9]*)")
+_COL = re.compile(r"col:([0-9]*)")
+
+# nodes that can contain the error location but are never the error location
+_NOT_ERROR_LOCATIONS = frozenset(("FunctionDecl", "CompoundStmt", "IfStmt",
+                                  "DoStmt", "WhileStmt", "ForStmt", "LabelStmt"))
+
 def get_hash(source):
     f = open(source, 'r', encoding='utf-8')
     hsh = hashfunc()
@@ -71,107 +91,111 @@ class YAMLWriter(object):
 
     def write(self, to):
         with open(to, "w") as witness_file:
-            yaml.safe_dump(self.witness, witness_file, default_style=None)
+            yaml.dump(self.witness, witness_file, Dumper=YAMLDumper, default_style=None)
  
     def get_locations(self):
         this_file = True
         shifterror = True
         call_map = dict()
         last_ln = "" 
-        ast = subprocess.run(['clang', '-Xclang', '-ast-dump', '-fsyntax-only', '-fno-color-diagnostics', self._source], 
-                             stdout=subprocess.PIPE, 
-                             stderr=subprocess.DEVNULL).stdout.decode('utf-8')
-        
-        for line in ast.splitlines():
-            # check if we have a begin and end
-            loc = re.search("^[^-]*-[a-zA-Z]* 0x[0-9A-Fa-f]* <([^>,]*), ([^,]*)>", line)
-
-            if not loc:  # if not, we only care about the line
-                ln = re.search("^[^-]*-[a-zA-Z]* 0x[0-9A-Fa-f]* <([^:>]*):([0-9]*)", line)
-                if ln and ln[1] != "col":
-                    last_ln = ln[2]
-                    if ln[1] != "line":
-                        this_file = ln[1] == self._source
-                continue
-
-            start = loc[1]
-            end = loc[2]
-
-            location = re.search("([^:]*):([0-9]*):([0-9]*)", start)
-            if not location:
-                if not this_file:
-                    continue
-                # if there's no line specified, use the previous one
-                name = None
-                start_ln = last_ln
-                start_col = re.search("col:([0-9]*)", start)[1]
-                if not start_col:
-                    continue
-            else:
-                name = location[1]
-                start_ln = location[2]
-                start_col = location[3]
-
-            # if there is a filename, check if its the program under validation - we do not care about headers
-            if name and name != "line":
-                if name != self._source:
-                    this_file = False
+        # read the dump line by line as clang produces it instead of keeping
+        # the whole (possibly huge) output in memory; a large pipe buffer
+        # keeps the number of read() calls low
+        with subprocess.Popen((*_CLANG_AST_DUMP, self._source),
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL,
+                              bufsize=1024 * 1024, encoding='utf-8',
+                              # clang does not use any of our file descriptors, but
+                              # closing them makes Python go through all open
+                              # descriptors before exec. Nothing sensitive is open
+                              # at this point, so we trade the isolation for a
+                              # cheaper spawn.
+                              close_fds=False) as proc:
+            for line in proc.stdout:
+                # check if we have a begin and end
+                loc = _LOC_BEGIN_END.search(line)
+
+                if not loc:  # if not, we only care about the line
+                    ln = _LOC_LINE.search(line)
+                    if ln and ln[1] != "col":
+                        last_ln = ln[2]
+                        if ln[1] != "line":
+                            this_file = ln[1] == self._source
                     continue
+
+                kind = loc[1]
+                start = loc[2]
+                end = loc[3]
+
+                location = _FILE_LINE_COL.search(start)
+                if not location:
+                    if not this_file:
+                        continue
+                    # if there's no line specified, use the previous one
+                    name = None
+                    start_ln = last_ln
+                    start_col = _COL.search(start)[1]
+                    if not start_col:
+                        continue
                 else:
-                    this_file = True
-
-            # update last line
-            last_ln = start_ln
-
-            # again, check if there's a line number, otherwise use previous
-            if "line" in end:
-                end_loc = re.search("line:([0-9]*):([0-9]*)", end)
-                end_ln, end_col = end_loc[1], end_loc[2]
-            else:
-                end_ln = last_ln
-                end_col_match = re.search("col:([0-9]*)", end)
-                if not end_col_match:
-                    this_file = False
-                    continue
-                end_col = end_col_match[1]
+                    name = location[1]
+                    start_ln = location[2]
+                    start_col = location[3]
+
+                # if there is a filename, check if its the program under validation - we do not care about headers
+                if name and name != "line":
+                    if name != self._source:
+                        this_file = False
+                        continue
+                    else:
+                        this_file = True
+
+                # update last line
+                last_ln = start_ln
+
+                # again, check if there's a line number, otherwise use previous
+                if "line" in end:
+                    end_loc = _LINE_LINE_COL.search(end)
+                    end_ln, end_col = end_loc[1], end_loc[2]
+                else:
+                    end_ln = last_ln
+                    end_col_match = _COL.search(end)
+                    if not end_col_match:
+                        this_file = False
+                        continue
+                    end_col = end_col_match[1]
 
-            last_ln = end_ln
+                last_ln = end_ln
 
-            if not this_file:
-                continue
+                if not this_file:
+                    continue
 
-            start_location = start_ln + ":" + start_col
-            end_location = end_ln + ":" + end_col
+                start_location = start_ln + ":" + start_col
+                end_location = end_ln + ":" + end_col
 
-            # index callmap by start location
-            if "CallExpr" in line:
-                if start_location not in call_map:
-                    call_map[start_location] = end_location
+                # index callmap by start location
+                if kind == "CallExpr":
+                    if start_location not in call_map:
+                        call_map[start_location] = end_location
 
-            if not shifterror or "FunctionDecl" in line \
-                or "CompoundStmt" in line \
-                or "IfStmt" in line \
-                or "DoStmt" in line \
-                or "WhileStmt" in line \
-                or "ForStmt" in line \
-                or "LabelStmt" in line:
-                continue
+                if not shifterror or kind in _NOT_ERROR_LOCATIONS:
+                    continue
             
 
-            if int(start_ln) > int(self.errorLoc[1]) or int(end_ln) < int(self.errorLoc[1]):
-                continue
+                if int(start_ln) > int(self.errorLoc[1]) or int(end_ln) < int(self.errorLoc[1]):
+                    continue
 
-            if (int(start_ln) == int(self.errorLoc[1]) and int(start_col) > int(self.errorLoc[2])) or \
-                (int(end_ln) == int(self.errorLoc[1]) and int(end_col) < int(self.errorLoc[2])):
-                continue
+                if (int(start_ln) == int(self.errorLoc[1]) and int(start_col) > int(self.errorLoc[2])) or \
+                    (int(end_ln) == int(self.errorLoc[1]) and int(end_col) < int(self.errorLoc[2])):
+                    continue
 
-            if "ReturnStmt" in line and (int(start_ln) != int(self.errorLoc[1]) or \
-                                                          int(start_col) != int(self.errorLoc[2])):
-                continue      
+                if kind == "ReturnStmt" and (int(start_ln) != int(self.errorLoc[1]) or \
+                                                              int(start_col) != int(self.errorLoc[2])):
+                    continue      
 
-            self.errorLoc[1] = int(start_ln)
-            self.errorLoc[2] = int(start_col)
-            shifterror = False
+                self.errorLoc[1] = int(start_ln)
+                self.errorLoc[2] = int(start_col)
+                shifterror = False
 
         if shifterror:
             print("Something went wrong. Error location might not comply with the witness format.")
@@ -1,7 +1,50 @@
 import sys
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, namedtuple
+
 import clang.cindex
 import yaml
 
+# use the libyaml bindings if they are available, they are much faster
+try:
+    from yaml import CSafeLoader as YAMLLoader, CSafeDumper as YAMLDumper
+except ImportError:
+    from yaml import SafeLoader as YAMLLoader, SafeDumper as YAMLDumper
+
+# cursor kinds that we check for (bound once to avoid the attribute lookups)
+_CK = clang.cindex.CursorKind
+_CALL_EXPR = _CK.CALL_EXPR
+_COMPOUND_STMT = _CK.COMPOUND_STMT
+_CONDITIONAL_OPERATOR = _CK.CONDITIONAL_OPERATOR
+_PAREN_EXPR = _CK.PAREN_EXPR
+_IF_STMT = _CK.IF_STMT
+_WHILE_STMT = _CK.WHILE_STMT
+_DO_STMT = _CK.DO_STMT
+_FOR_STMT = _CK.FOR_STMT
+_SWITCH_STMT = _CK.SWITCH_STMT
+_CASE_STMT = _CK.CASE_STMT
+_FUNCTION_DECL = _CK.FUNCTION_DECL
+
+_BRANCHING_STMTS = (_IF_STMT, _WHILE_STMT, _DO_STMT, _FOR_STMT, _SWITCH_STMT)
+
+# kinds of waypoints (combined as flags in ValidationTransformer._loc_index)
+_ASSUMPTION = 1
+_BRANCHING = 2
+_TARGET = 4
+_CALL = 8
+
+_WAYPOINT_KINDS = {
+    'function_return': _CALL,
+    'function_enter': _CALL,
+    'assumption': _ASSUMPTION,
+    'branching': _BRANCHING,
+    'target': _TARGET,
+}
+
+# a piece of code (encoded as bytes) to be inserted into the program
+# before the given line and column
+_Insert = namedtuple('_Insert', 'line col value')
+
 
 class ValidationTransformer:
     def __init__(self, program_file, witness_file, out_program, out_witness):
@@ -12,10 +55,13 @@ class ValidationTransformer:
         self.out_witness = out_witness
 
         with open(self.witness_file, 'r') as file:
-            self.witness = yaml.safe_load(file)
+            self.witness = yaml.load(file, Loader=YAMLLoader)
 
-        with open(self.program_file, 'r') as c_file:
-            self.c_lines = c_file.readlines()
+        # Keep the program as bytes: libclang columns are byte offsets, so we can
+        # index the lines with them directly even if the source is not plain ASCII.
+        # bytes.splitlines() splits only on \n, \r\n and \r, the same as clang.
+        with open(self.program_file, 'rb') as c_file:
+            self.c_lines = c_file.read().splitlines(keepends=True)
 
         # Keep information about the statements and expressions mentioned in the witness:
         self._calls = dict()        # {witness_location : begin_location}
@@ -23,11 +69,17 @@ class ValidationTransformer:
         self._branchings = dict()   # {witness_location : (control_expr_begin, control_expr_end, col)}
         self._switches = dict()     # {witness_location : (control_expr_begin, control_expr_end, col)}
         self._target = dict()       # {witness_location : (begin_location, end_location)}
+        # Kinds of the waypoints (_ASSUMPTION | _BRANCHING | _TARGET) at each witness location,
+        # so that the AST traversal needs one lookup per location instead of one per map
+        self._loc_index = dict()    # {witness_location : kinds}
+        self._waypoints = []        # each item is (kind, segment index, waypoint)
+        self._witness_lines = []    # sorted lines of all witness locations
+        self._line_only_lines = set()  # lines of the _loc_index locations without a column
 
         # Keep information about what we want to insert into the C code
         # and how the witness locations will change
-        self._insert = []  # each item is (line, col, value)
-        self._shift = {}  # locations that were shifted to the right
+        self._insert = []  # each item is an _Insert
+        self._shift_sorted = {}  # {line : (sorted shifted columns, cumulative shifts)}
 
         self.check_witness_structure()
 
@@ -44,7 +96,7 @@ class ValidationTransformer:
         # collect relevant program locations and their types and check basic syntax
         # of the witness
 
-        for s in self.witness[0]['content']:
+        for s_index, s in enumerate(self.witness[0]['content']):
             assert 'segment' in s, 'Invalid witness syntax!'
             segment = s['segment']
 
@@ -68,102 +120,147 @@ class ValidationTransformer:
                     waypoint['location']['column'] = 0
                 col = waypoint['location']['column'] # if 'column' in waypoint['location'] else 0
 
-                if waypoint['type'] == 'target':
+                kind = _WAYPOINT_KINDS.get(waypoint['type'])
+                assert kind is not None, 'Unknown waypoint type:' + waypoint['type']
+                self._waypoints.append((kind, s_index, waypoint))
+
+                if kind == _CALL:
+                    # calls are looked up by their end location, not via _loc_index
+                    self._calls[(line, col)] = None
+                    continue
+
+                if kind == _TARGET:
                     assert waypoint['action'] == 'follow'
                     assert s == self.witness[0]['content'][-1]
                     self._target[line, col] = None
-                    break
-
-                map = None
-                if waypoint['type'] == 'function_return' or waypoint['type'] == 'function_enter':
-                    map = self._calls
-                if waypoint['type'] == 'assumption':
-                    map = self._assumptions
-                if waypoint['type'] == 'branching':
-                    map = self._branchings
+                elif kind == _ASSUMPTION:
+                    self._assumptions[(line, col)] = None
+                else:
+                    self._branchings[(line, col)] = None
                     self._switches[(line, col)] = None
 
-                assert map is not None, 'Unknown waypoint type:' + waypoint['type']
+                self._loc_index[line, col] = self._loc_index.get((line, col), 0) | kind
 
-                map[(line, col)] = None
+                if kind == _TARGET:
+                    break
         
         assert self._target, "Missing target waypoint!"
 
+        self._witness_lines = sorted({loc[0] for loc in self._calls} | {loc[0] for loc in self._loc_index})
+        self._line_only_lines = {line for line, col in self._loc_index if col == 0}
+
+    # Is any witness location on the lines startline..endline?
+    def _has_witness_line(self, startline, endline):
+        idx = bisect_left(self._witness_lines, startline)
+        return idx < len(self._witness_lines) and self._witness_lines[idx] <= endline
+
     # Traverse the AST, find the locations mentioned in the witness and store information
     # about them in one of: _calls, _assumptions, _branchings, _target.
-    def traverse_AST(self, node, full=True):
-        # Recurse for children of this node
-        child_index = 0
-        for child in node.get_children():
-            if child.location.file.name != self.program_file:
+    def traverse_AST(self, root):
+        loc_get = self._loc_index.get
+        line_only_lines = self._line_only_lines
+        program_file = self.program_file
+
+        # The traversal is a pre-order DFS with an explicit stack instead of
+        # recursion, so deeply nested programs do not hit the recursion limit.
+        # Each frame is (node, node kind, full, children iterator), and
+        # child_indices keeps the index of the next child for every frame.
+        # Children from other files (headers) are skipped together with their
+        # whole subtrees.
+        stack = [(root, root.kind, True, root.get_children())]
+        child_indices = [0]
+        while stack:
+            node, node_kind, full, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                child_indices.pop()
+                continue
+
+            file = child.location.file
+            if file is None or file.name != program_file:
                 continue
 
+            kind = child.kind
+            is_expr = is_expression_kind(kind)
             start = child.extent.start
             end = child.extent.end
 
+            pos = (start.line, start.column)
+            here = loc_get(pos, 0)  # waypoints exactly at the start of the child
+            on_line = 0             # waypoints with only the line of the child
+            if start.line in line_only_lines:
+                line_pos = (start.line, 0)
+                on_line = loc_get(line_pos, 0)
+
             # For all function calls and returns, we change the location
             # from the right paranthesis to the position of the call.
-            if child.kind == clang.cindex.CursorKind.CALL_EXPR:
-                if (end.line, end.column - 1) in self._calls:
-                    self._calls[(end.line, end.column - 1)] = start.line, start.column
-                if (end.line, 0) in self._calls and not self._calls[(end.line, 0)]:
-                    self._calls[(end.line, 0)] = start.line, start.column
+            if kind == _CALL_EXPR:
+                calls = self._calls
+                rparen = (end.line, end.column - 1)
+                if rparen in calls:
+                    calls[rparen] = pos
+                if calls.get((end.line, 0), False) is None:
+                    calls[(end.line, 0)] = pos
 
             # For branching waypoints, we find the corresponding control expression
             # and assign an identifier.
-            if (start.line, start.column) in self._branchings:
-                self._handle_branching(child, (start.line, start.column))
-            if (start.line, 0) in self._branchings and not self._branchings[(start.line, 0)]:
-                self._handle_branching(child, (start.line, 0))
+            if here & _BRANCHING:
+                self._handle_branching(child, pos)
+            if on_line & _BRANCHING and not self._branchings[line_pos]:
+                self._handle_branching(child, line_pos)
 
-            if child.kind == clang.cindex.CursorKind.CONDITIONAL_OPERATOR:
+            if kind == _CONDITIONAL_OPERATOR:
                 self._handle_ternary(child)
 
             # For assumption waypoint, we check whether they point to a statement and remember the statements range,
             # if necessary
-            if (start.line, start.column) in self._assumptions \
-                    or (start.line, 0) in self._assumptions and self._assumptions[start.line, 0] is None:
-                is_stmt = is_statement(node, child_index, child)
+            if here & _ASSUMPTION \
+                    or on_line & _ASSUMPTION and self._assumptions[line_pos] is None:
+                is_stmt = is_statement(node, child_indices[-1], child)
 
                 if is_stmt:
                     brackets = True
                     begin = start.line, start.column
                     end = end.line, end.column
-                    if node.kind == clang.cindex.CursorKind.COMPOUND_STMT:
+                    if node_kind == _COMPOUND_STMT:
                         brackets = False
-                    if child.kind == clang.cindex.CursorKind.COMPOUND_STMT:
+                    if kind == _COMPOUND_STMT:
                         brackets = False
                         begin = begin[0], begin[1] + 1
 
-                    if (start.line, start.column) in self._assumptions:
-                        self._assumptions[start.line, start.column] = begin, end, brackets
+                    if here & _ASSUMPTION:
+                        self._assumptions[pos] = begin, end, brackets
 
-                    if (start.line, 0) in self._assumptions and not self._assumptions[start.line, 0]:
-                        self._assumptions[start.line, 0] = begin, end, brackets
+                    if on_line & _ASSUMPTION and not self._assumptions[line_pos]:
+                        self._assumptions[line_pos] = begin, end, brackets
 
             # For target, we check that the location points to an expression statement or a full expression
-            if (start.line, start.column) in self._target \
-                    or ((start.line, 0) in self._target and not self._target[(start.line, 0)]):
+            if here & _TARGET or (on_line & _TARGET and not self._target[line_pos]):
 
-                if child.kind.is_expression() and full:
-                    col = 0 if (start.line, 0) in self._target else start.column
+                if is_expr and full:
+                    col = 0 if on_line & _TARGET else start.column
                     self._target[(start.line, col)] = \
                         (start.line, start.column), (child.extent.end.line, child.extent.end.column)
 
-            child_index += 1
-            self.traverse_AST(child, full and not child.kind.is_expression()) 
+            child_indices[-1] += 1
+            # There is nothing to find in functions that no witness location points into
+            if kind != _FUNCTION_DECL or self._has_witness_line(start.line, child.extent.end.line):
+                stack.append((child, kind, full and not is_expr, child.get_children()))
+                child_indices.append(0)
 
     def _handle_ternary(self, node):
-        children = list(node.get_children())
-        start = children[0].extent.end
-        end = children[1].extent.start
+        children = node.get_children()
+        cond = next(children)
+        true_expr = next(children)
+        start = cond.extent.end
+        end = true_expr.extent.start
 
         q_loc = self._find_q_mark(start.line, start.column, end.line, end.column)
         if not q_loc:
             return
 
-        ctrl_expr = children[0] if children[0].kind != clang.cindex.CursorKind.PAREN_EXPR \
-            else list(children[0].get_children())[0]
+        ctrl_expr = cond if cond.kind != _PAREN_EXPR else next(cond.get_children())
 
         if q_loc in self._branchings:
             self._add_branchinfo(q_loc[1], q_loc, ctrl_expr.extent)
@@ -171,29 +268,27 @@ class ValidationTransformer:
             self._add_branchinfo(q_loc[1], (q_loc[0], 0), ctrl_expr.extent)
 
     def _handle_branching(self, node, loc):
-        col = node.extent.start.column
-        children = list(node.get_children())
-        if node.kind == clang.cindex.CursorKind.IF_STMT:
-            ctrl_expr = children[0]
-            self._add_branchinfo(col, loc, ctrl_expr.extent)
-
-        if node.kind == clang.cindex.CursorKind.WHILE_STMT:
-            ctrl_expr = children[0]
-            self._add_branchinfo(col, loc, ctrl_expr.extent)
-
-        if node.kind == clang.cindex.CursorKind.DO_STMT:
-            ctrl_expr = children[1]
-            self._add_branchinfo(col, loc, ctrl_expr.extent)
+        kind = node.kind
+        if kind not in _BRANCHING_STMTS:
+            return
 
-        if node.kind == clang.cindex.CursorKind.FOR_STMT:
-            extent = children[1].extent
+        col = node.extent.start.column
+        # the control expression is the first child except for do-while
+        # (the body goes first) and for (we want the condition, not the init)
+        children = node.get_children()
+        if kind == _DO_STMT or kind == _FOR_STMT:
+            next(children)
+        ctrl_expr = next(children)
+
+        if kind == _FOR_STMT:
+            extent = ctrl_expr.extent
             self._branchings[loc] = (extent.start.line, extent.start.column), \
                                     (extent.end.line, extent.end.column -1), \
                                     col
-
-        if node.kind == clang.cindex.CursorKind.SWITCH_STMT:
-            ctrl_expr = children[0]
+        elif kind == _SWITCH_STMT:
             self._add_switchinfo(col, loc, ctrl_expr.extent)
+        else:
+            self._add_branchinfo(col, loc, ctrl_expr.extent)
 
     def _add_branchinfo(self, col, loc, extent):
         self._branchings[loc] = (extent.start.line, extent.start.column), \
@@ -208,7 +303,6 @@ class ValidationTransformer:
     def transform(self):
 
         self._get_witness_locations()
-        sys.setrecursionlimit(2048)
 
         index = clang.cindex.Index.create()
         tu = index.parse(self.program_file, args=['-fbracket-depth=2048'])
@@ -216,167 +310,200 @@ class ValidationTransformer:
 
         self.traverse_AST(root)
 
-        content = self.witness[0]['content']
-        s_index = 0
         conditions_covered = set()
-        for s in content:
-            segment = s['segment']
-            for w in segment:
-                waypoint = w['waypoint']
-
-                line = waypoint['location']['line']
-                col = waypoint['location']['column']
-
-                if waypoint['type'] == 'function_return' or waypoint['type'] == 'function_enter':
-                    if self._calls[line, col] is None:
-                        sys.exit('Invalid location for function call or return: {},{}'.format(line, col))
-
-                    waypoint['location']['line'], waypoint['location']['column'] = self._calls[line, col]
-
-                if waypoint['type'] == 'target':
-                    if self._target[line, col] is None:
-                        sys.exit('Invalid location for target: {},{}'.format(line, col))
- 
-                    waypoint['location']['column'] = self._target[line, col][0][1]
-                    waypoint['location2'] = {}
-                    waypoint['location2']['line'], waypoint['location2']['column'] = self._target[line, col][1]
-
-                if waypoint['type'] == 'assumption':
-                    if not self._assumptions[line, col]:
-                        sys.exit('Invalid location for branching: {},{}'.format(line, col))
-
-                    start, end, bracket = self._assumptions[line, col]
-
-                    if bracket:
-                        self._insert.append((end[0], end[1] + 1, ';}'))
-
-                    call = create_assumption(waypoint['constraint']['value'],
-                                             s_index, waypoint['action'] == 'follow', bracket)
-                    self._insert.append((start[0], start[1], call))
-
-                if waypoint['type'] == 'branching':
-
-                    if self._branchings[line, col] is not None:
-                        ctrl_expr_start, ctrl_expr_end, column = self._branchings[line, col]
-                        fun = '__VALIDATOR_branch'
-                    elif self._switches[line, col] is not None:
-                        ctrl_expr_start, ctrl_expr_end, column = self._switches[line, col]
-                        fun = '__VALIDATOR_switch'
-                    else:
-                        sys.exit('Invalid location for branching: {},{}'.format(line, col))
-                    
-                    if col == 0:
-                        waypoint['location']['column'] = column
-
-                    loc = (line, column)
-                    if loc not in conditions_covered:
-                        self._insert.append((ctrl_expr_start[0], ctrl_expr_start[1],
-                                             fun + '(' + str(line) + ', ' + str(column) + ', '))
-                        self._insert.append((ctrl_expr_end[0], ctrl_expr_end[1] + 1, ')'))
-                        conditions_covered.add(loc)
-
-            s_index += 1
+        insert = self._insert.append
+        for kind, s_index, waypoint in self._waypoints:
+            location = waypoint['location']
+
+            line = location['line']
+            col = location['column']
+            loc = (line, col)
+
+            if kind == _CALL:
+                call = self._calls[loc]
+                if call is None:
+                    sys.exit('Invalid location for function call or return: {},{}'.format(line, col))
+
+                location['line'], location['column'] = call
+
+            elif kind == _TARGET:
+                target = self._target[loc]
+                if target is None:
+                    sys.exit('Invalid location for target: {},{}'.format(line, col))
+
+                location['column'] = target[0][1]
+                waypoint['location2'] = {}
+                waypoint['location2']['line'], waypoint['location2']['column'] = target[1]
+
+            elif kind == _ASSUMPTION:
+                assumption = self._assumptions[loc]
+                if not assumption:
+                    sys.exit('Invalid location for assumption: {},{}'.format(line, col))
+
+                start, end, bracket = assumption
+
+                if bracket:
+                    insert(_Insert(end[0], end[1] + 1, b';}'))
+
+                call = create_assumption(waypoint['constraint']['value'],
+                                         s_index, waypoint['action'] == 'follow', bracket)
+                insert(_Insert(start[0], start[1], call.encode()))
+
+            elif kind == _BRANCHING:
+                branching = self._branchings[loc]
+                if branching is not None:
+                    ctrl_expr_start, ctrl_expr_end, column = branching
+                    fun = '__VALIDATOR_branch'
+                elif self._switches[loc] is not None:
+                    ctrl_expr_start, ctrl_expr_end, column = self._switches[loc]
+                    fun = '__VALIDATOR_switch'
+                else:
+                    sys.exit('Invalid location for branching: {},{}'.format(line, col))
+
+                if col == 0:
+                    location['column'] = column
+
+                cond = (line, column)
+                if cond not in conditions_covered:
+                    insert(_Insert(ctrl_expr_start[0], ctrl_expr_start[1],
+                                   f'{fun}({line}, {column}, '.encode()))
+                    insert(_Insert(ctrl_expr_end[0], ctrl_expr_end[1] + 1, b')'))
+                    conditions_covered.add(cond)
 
         self._insert_calls()
-        self.witness[0]['content'] = self._shift_witness(content)
+        self._shift_witness()
 
         with open(self.out_witness, 'w') as witness_file2:
-            yaml.dump(self.witness, witness_file2, default_style=None)
+            yaml.dump(self.witness, witness_file2, Dumper=YAMLDumper, default_style=None)
 
-        with open(self.out_program, 'w') as program_file2:
-            program_file2.writelines(self.c_lines)
+        with open(self.out_program, 'wb') as program_file2:
+            program_file2.write(b''.join(self.c_lines))
 
     def _insert_calls(self):
-        self._insert.sort(key=lambda item: item[2])
-        self._insert.sort(key=lambda item: item[1], reverse = True)
-        self._insert.sort(key=lambda item: item[0], reverse = True)
-
-        for line, col, value in self._insert:
-            self.c_lines[line - 1] = self.c_lines[line - 1][: col - 1] + value + self.c_lines[line - 1][col - 1:]
-            self._add_shift(line, col, len(value))
-
-    def _add_shift(self, line, col, length):
-        if line in self._shift and col in self._shift[line]:
-            self._shift[line][col] += length
-        else:
-            self._shift[line] = {}
-            self._shift[line][col] = length
+        # Lines are modified independently of each other, so we only need
+        # to order the inserts within each line.
+        by_line = defaultdict(list)
+        for ins in self._insert:
+            by_line[ins.line].append(ins)
+
+        # Rebuild every modified line just once. We go through the inserts
+        # from right to left, so we collect the pieces in reverse order.
+        for line, inserts in by_line.items():
+            # columns from right to left, values at the same column in ascending order
+            inserts.sort(key=lambda ins: (-ins.col, ins.value))
+
+            text = self.c_lines[line - 1]
+            parts = []
+            prev = len(text)
+            for _, col, value in inserts:
+                parts.append(text[col - 1:prev])
+                parts.append(value)
+                prev = col - 1
+            parts.append(text[:prev])
+            parts.reverse()
+            self.c_lines[line - 1] = b''.join(parts)
+
+            # Remember how the locations on this line were shifted: for each
+            # column with an insert, the length of everything inserted up to it.
+            cols, cumulative = [], []
+            shift = 0
+            for _, col, value in reversed(inserts):
+                shift += len(value)
+                if cols and cols[-1] == col:
+                    cumulative[-1] = shift
+                else:
+                    cols.append(col)
+                    cumulative.append(shift)
+            self._shift_sorted[line] = cols, cumulative
+
+    # Return by how much a location on the given line and column was shifted,
+    # i.e., the total length of everything inserted at or before the column.
+    def _get_shift(self, line, col):
+        if line not in self._shift_sorted:
+            return 0
+        cols, cumulative = self._shift_sorted[line]
+        idx = bisect_right(cols, col)
+        return cumulative[idx - 1] if idx else 0
 
     # After we inserted some calls into the C code, some statements described in the witness
     # have changed locations, and we need to adjust it.
-    def _shift_witness(self, content):
-        for s in content:
-            segment = s['segment']
-            for w in segment:
-                waypoint = w['waypoint']
-
-                # We do not care about these locations anymore
-                if waypoint['type'] == 'assumption' or waypoint['type'] == 'branching':
-                    continue
-
-                if waypoint['location']['line'] in self._shift.keys():
-                    add = 0
-                    for col in self._shift[waypoint['location']['line']]:
-                        if waypoint['location']['column'] >= col:
-                            add += self._shift[waypoint['location']['line']][col]
-                    waypoint['location']['column'] += add
+    def _shift_witness(self):
+        for kind, _, waypoint in self._waypoints:
+            # We do not care about these locations anymore
+            if kind == _ASSUMPTION or kind == _BRANCHING:
+                continue
 
-        # Shift end location of target
-        target = content[-1]['segment'][-1]['waypoint']
-        if 'location2' in target and target['location2']['line'] in self._shift.keys():
-            add = 0
-            for col in self._shift[waypoint['location2']['line']]:
-                if target['location2']['column'] >= col:
-                    add += self._shift[target['location2']['line']][col]
-                target['location2']['column'] += add
+            location = waypoint['location']
+            location['column'] += self._get_shift(location['line'], location['column'])
 
-        return content
+        # Shift end location of target (which is always the last waypoint)
+        target = self._waypoints[-1][2]
+        if 'location2' in target:
+            location2 = target['location2']
+            location2['column'] += self._get_shift(location2['line'], location2['column'])
 
     def _find_q_mark(self, startline, startcol, endline, endcol):
         if startline == endline:
-            for col in range(startcol, endcol):
-                if self.c_lines[startline - 1][col - 1] == '?':
-                    return startline, col
-        else:
-            for col in range(startcol, len(self.c_lines[startline - 1])):
-                if self.c_lines[startline - 1][col - 1] == '?':
-                    return startline, col
-            for line in range(startline + 1, endline):
-                for col in range(1, len(self.c_lines[line - 1])):
-                    if self.c_lines[line - 1][col - 1] == '?':
-                        return line, col
-            for col in range(1, endcol):
-                if self.c_lines[endline - 1][col - 1] == '?':
-                    return endline, col
+            idx = self.c_lines[startline - 1].find(b'?', startcol - 1, endcol - 1)
+            return (startline, idx + 1) if idx != -1 else None
+
+        idx = self.c_lines[startline - 1].find(b'?', startcol - 1)
+        if idx != -1:
+            return startline, idx + 1
+        for line in range(startline + 1, endline):
+            idx = self.c_lines[line - 1].find(b'?')
+            if idx != -1:
+                return line, idx + 1
+        idx = self.c_lines[endline - 1].find(b'?', 0, endcol - 1)
+        if idx != -1:
+            return endline, idx + 1
 
         return None
 
 
 def create_assumption(constraint, segment, follow, bracket):
     prefix = '{' if bracket else ''
-    call_scheme = 'if(__VALIDATOR_segment({seg})) __VALIDATOR_assume({constr}, {foll}); '
-    call = prefix + call_scheme.format(constr=constraint.strip(';'), seg=segment, foll=1 if follow else 0)
-    return call
+    constraint = constraint.strip(';')
+    return f'{prefix}if(__VALIDATOR_segment({segment})) __VALIDATOR_assume({constraint}, {1 if follow else 0}); '
 
 
 def is_statement(parent, child_index, child):
-    types = clang.cindex.CursorKind
+    kind = parent.kind
 
-    if parent.kind == types.COMPOUND_STMT or child.kind.is_statement():
+    if kind == _COMPOUND_STMT or is_statement_kind(child.kind):
         return True
 
-    if (parent.kind == types.WHILE_STMT
-        or parent.kind == types.SWITCH_STMT
-        or parent.kind == types.FOR_STMT
-        or parent.kind == types.CASE_STMT) and \
-            child_index == len(parent.get_children()) - 1:
+    if (kind == _WHILE_STMT
+        or kind == _SWITCH_STMT
+        or kind == _FOR_STMT
+        or kind == _CASE_STMT) and \
+            child_index == len(list(parent.get_children())) - 1:
         return True
 
-    if parent.kind == types.IF_STMT and child_index != 0:
+    if kind == _IF_STMT and child_index != 0:
         return True
 
-    if parent.kind == types.DO_STMT and child_index == 0:
+    if kind == _DO_STMT and child_index == 0:
         return True
 
     return False
 
+
+# CursorKind.is_expression() and is_statement() call into libclang, but the
+# answer depends only on the kind, so we remember it for every kind we meet.
+_expression_kinds = {}
+_statement_kinds = {}
+
+
+def is_expression_kind(kind):
+    res = _expression_kinds.get(kind)
+    if res is None:
+        res = _expression_kinds[kind] = kind.is_expression()
+    return res
+
+
+def is_statement_kind(kind):
+    res = _statement_kinds.get(kind)
+    if res is None:
+        res = _statement_kinds[kind] = kind.is_statement()
+    return res